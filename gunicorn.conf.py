@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Configuração do gunicorn para produção fora do Vercel.
+# Equivale a: gunicorn --preload -w (2 * núcleos + 1) -k gevent --worker-connections 1000 -b 0.0.0.0:$PORT wsgi:app
+# O monkey patch do gevent é feito aqui, e não em servidor.py, para não afetar o deploy no Vercel.
+# Ele vem primeiro para que o app pré-carregado já importe os módulos com o gevent ativo; assim
+# sockets, locks e o psycopg 3 cedem a vez enquanto esperam a rede (banco e APIs de Pix).
+from gevent import monkey
+monkey.patch_all()
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = (os.cpu_count() or 1) * 2 + 1
+
+# Cada worker tem seu próprio pool, então o total de conexões com o PostgreSQL é
+# workers * PG_POOL_MAX. PG_POOL_TOTAL (padrão: 2 * núcleos + 1) é dividido entre os workers
+# para não ultrapassar o max_connections do banco (um compute pequeno do Neon tem poucas).
+# Defina PG_POOL_MAX diretamente para escolher o tamanho por worker.
+PG_POOL_TOTAL = int(os.environ.get('PG_POOL_TOTAL', (os.cpu_count() or 1) * 2 + 1))
+os.environ.setdefault('PG_POOL_MAX', str(max(1, PG_POOL_TOTAL // workers)))
+worker_class = 'gevent'
+worker_connections = 1000
+# Carrega o app uma vez no processo mestre; os workers herdam o código já importado
+preload_app = True
+
+def when_ready(server):
+    """
+    Fecha, no processo mestre, as conexões abertas durante o pré-carregamento (init_db),
+    para que os workers não herdem sockets do PostgreSQL compartilhados.
+    """
+    import servidor
+    if servidor.POOL is not None:
+        servidor.POOL.close()
+
+def post_fork(server, worker):
+    """
+    Cria um pool de conexões próprio em cada worker.
+    """
+    import servidor
+    servidor.POOL = servidor.create_pool()
@@ -1,104 +1,496 @@
 # -*- coding: utf-8 -*-
 # Importa as bibliotecas necessárias
 import os
-import psycopg2 # Importa o driver PostgreSQL
+from psycopg import Rollback # Driver PostgreSQL (psycopg 3)
+from psycopg_pool import ConnectionPool
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 import uuid
-from flask import Flask, request, jsonify, g
+from flask import Flask, request, g
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from datetime import datetime
 import functools
+from abc import ABC, abstractmethod
+import threading
+from cachetools import TTLCache
+
+class OrjsonProvider(JSONProvider):
+    """
+    Provedor JSON do Flask baseado no orjson, usado ao ler request.json.
+    """
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Inicializa a aplicação Flask
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 # Habilita o CORS para permitir requisições de diferentes origens, como o seu frontend.
 CORS(app)
 
 # Nome da variável de ambiente que conterá a URL de conexão do Neon
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# Tamanho máximo do pool de conexões deste processo. Padrão: (núcleos * 2) + 1, pensado como
+# total da máquina; com vários processos (gunicorn), PG_POOL_MAX deve dividir esse total entre eles.
+POOL_MAX_CONN = int(os.environ.get('PG_POOL_MAX', (os.cpu_count() or 1) * 2 + 1))
+
+# Prepared statements no protocolo (psycopg 3): cada consulta é preparada na primeira execução
+# em cada conexão do pool. Defina PG_PREPARED_STATEMENTS=0 ao usar um PgBouncer sem suporte
+# a prepared statements em modo transaction.
+PG_PREPARED_STATEMENTS = os.environ.get('PG_PREPARED_STATEMENTS', '1') != '0'
+
+# Consultas das rotas, em bytes para evitar codificar a string a cada requisição
+_SQL_USER_BY_TOKEN = b"SELECT id FROM users WHERE auth_token = %s"
+_SQL_ACTIVE_API_BY_TOKEN = b"""
+    SELECT u.id, a.name, a.type, a.public_key, a.secret_key, a.token
+    FROM apis a JOIN users u ON u.id = a.user_id
+    WHERE u.auth_token = %s AND a.is_active
+"""
+# Atualiza todas as APIs do usuário: assim o UPDATE bloqueia e reavalia cada linha,
+# e ativações concorrentes do mesmo usuário nunca deixam duas APIs ativas
+_SQL_SET_ACTIVE_API = b"""
+    UPDATE apis SET is_active = (id = %s)
+    WHERE user_id = %s
+    RETURNING id
+"""
+_SQL_REGISTER_USER = b"""
+    INSERT INTO users (username, auth_token) VALUES (%s, %s)
+    ON CONFLICT (username) DO NOTHING
+    RETURNING id
+"""
+# Insere N APIs em um único comando: cada coluna chega como um array e o unnest as transforma em linhas
+_SQL_INSERT_APIS = b"""
+    INSERT INTO apis (user_id, name, type, public_key, secret_key, token)
+    SELECT %s::integer, * FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[], %s::text[])
+    ON CONFLICT (user_id, name) DO NOTHING
+    RETURNING name
+"""
+_SQL_LIST_APIS_JSON = b"""
+    SELECT COALESCE(json_agg(json_build_object('id', id, 'name', name, 'isActive', is_active) ORDER BY id), '[]')::text
+    FROM apis WHERE user_id = %s
+"""
+
 # --- Funções para gerenciar o banco de dados ---
+def create_pool():
+    """
+    Cria o pool de conexões com o banco de dados PostgreSQL.
+    As conexões são abertas uma vez e reutilizadas entre as requisições,
+    evitando o handshake TCP/TLS/autenticação a cada chamada.
+    Quando o pool está esgotado, a requisição espera por uma conexão livre.
+    No Neon em ambiente serverless, use o host com sufixo '-pooler' na
+    DATABASE_URL para passar pelo PgBouncer.
+    """
+    if not DATABASE_URL:
+        return None
+    return ConnectionPool(
+        DATABASE_URL,
+        min_size=1,
+        max_size=POOL_MAX_CONN,
+        # Testa a conexão ao retirá-la do pool: o Neon encerra as sessões quando suspende
+        # o compute ocioso, e a primeira requisição após a retomada receberia uma conexão morta
+        check=ConnectionPool.check_connection,
+        # Autocommit: leituras não deixam transação aberta, então a conexão volta ao pool sem
+        # ROLLBACK (que descartaria os prepared statements); as escritas usam conn.transaction()
+        kwargs={'autocommit': True, 'prepare_threshold': 0 if PG_PREPARED_STATEMENTS else None},
+        open=True,
+    )
+
+POOL = create_pool()
+
+def release_db(conn):
+    """
+    Devolve uma conexão ao pool. Com autocommit não há transação pendente; se houver
+    (ou se a conexão estiver quebrada), o próprio pool a desfaz ou descarta a conexão.
+    """
+    POOL.putconn(conn)
+
 def get_db():
     """
     Função para obter a conexão com o banco de dados PostgreSQL.
-    A conexão é armazenada no contexto de requisição 'g' para ser reutilizada.
+    A conexão é retirada do pool e armazenada no contexto de requisição 'g' para ser reutilizada.
     """
     if not hasattr(g, 'pg_db'):
-        if not DATABASE_URL:
+        if POOL is None:
             raise ValueError("DATABASE_URL não configurada nas variáveis de ambiente.")
-        g.pg_db = psycopg2.connect(DATABASE_URL)
-        # Configura o cursor para retornar linhas como dicionários
-        # Para acessar por nome da coluna: row['column_name']
-        # Para acessar por índice: row[0]
-        # psycopg2.extras.DictCursor pode ser usado para um comportamento mais parecido com sqlite3.Row
+        g.pg_db = POOL.getconn()
     return g.pg_db
 
+def release_request_db():
+    """
+    Devolve ao pool a conexão da requisição atual, se houver.
+    Pode ser chamada antes do fim da requisição para não segurar a conexão durante chamadas externas.
+    """
+    db = g.pop('pg_db', None)
+    if db is not None:
+        release_db(db)
+
 @app.teardown_appcontext
 def close_connection(exception):
     """
-    Fecha a conexão com o banco de dados no final da requisição.
+    Devolve a conexão ao pool no final da requisição.
+    Conexões quebradas são descartadas pelo próprio pool.
     """
-    db = getattr(g, 'pg_db', None)
-    if db is not None:
-        db.close()
+    release_request_db()
 
 def init_db():
     """
     Inicializa o banco de dados, criando as tabelas se elas não existirem.
     Isso deve ser chamado uma vez na inicialização da aplicação.
     """
+    if POOL is None:
+        print("Erro ao inicializar o banco de dados: DATABASE_URL não configurada.")
+        return
+
+    # Fora de uma requisição não há contexto 'g', então a conexão vem direto do pool
     conn = None
     try:
-        conn = get_db()
+        conn = POOL.getconn()
         cursor = conn.cursor()
+
+        # Sonda rápida: se o último objeto do esquema já existe, não há DDL a executar.
+        # Atualize o nome sondado ao acrescentar novas tabelas/índices abaixo.
+        cursor.execute("SELECT to_regclass('public.apis_one_active_per_user')")
+        if cursor.fetchone()[0] is not None:
+            cursor.close()
+            return
         
-        # Tabela de usuários para autenticação
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username VARCHAR(255) NOT NULL UNIQUE,
-                auth_token VARCHAR(255) NOT NULL UNIQUE
-            )
-        """)
-        # Tabela de APIs, vinculada ao usuário
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS apis (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER NOT NULL,
-                name VARCHAR(255) NOT NULL,
-                type VARCHAR(255) NOT NULL,
-                public_key TEXT,
-                secret_key TEXT,
-                token TEXT,
-                is_active BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY (user_id) REFERENCES users(id),
-                UNIQUE (user_id, name) -- Garante que um usuário não tenha duas APIs com o mesmo nome
-            )
-        """)
-        conn.commit()
+        # O DDL roda em uma única transação
+        with conn.transaction():
+            # Tabela de usuários para autenticação
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    username VARCHAR(255) NOT NULL UNIQUE,
+                    auth_token VARCHAR(255) NOT NULL UNIQUE
+                )
+            """)
+            # Tabela de APIs, vinculada ao usuário
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS apis (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    name VARCHAR(255) NOT NULL,
+                    type VARCHAR(255) NOT NULL,
+                    public_key TEXT,
+                    secret_key TEXT,
+                    token TEXT,
+                    is_active BOOLEAN DEFAULT FALSE,
+                    FOREIGN KEY (user_id) REFERENCES users(id),
+                    UNIQUE (user_id, name) -- Garante que um usuário não tenha duas APIs com o mesmo nome
+                )
+            """)
+            # users.auth_token já é indexado pela restrição UNIQUE.
+            # Garante no banco no máximo uma API ativa por usuário; o índice parcial da restrição
+            # também atende a busca da API ativa (gerar/verificar Pix). DEFERRABLE faz a verificação
+            # ao fim do comando, permitindo trocar a API ativa em um único UPDATE.
+            cursor.execute("""
+                DO $$
+                BEGIN
+                    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'apis_one_active_per_user') THEN
+                        ALTER TABLE apis ADD CONSTRAINT apis_one_active_per_user
+                            EXCLUDE USING btree (user_id WITH =) WHERE (is_active)
+                            DEFERRABLE INITIALLY IMMEDIATE;
+                    END IF;
+                END
+                $$
+            """)
+            # Substituído pelo índice da restrição acima
+            cursor.execute("DROP INDEX IF EXISTS idx_apis_user_active")
         cursor.close()
     except Exception as e:
+        # A transação do DDL já foi desfeita ao sair do bloco conn.transaction()
         print(f"Erro ao inicializar o banco de dados: {e}")
-        if conn:
-            conn.rollback() # Desfaz a transação em caso de erro
     finally:
         if conn:
-            conn.close() # Garante que a conexão seja fechada
+            release_db(conn) # Garante que a conexão volte ao pool
 
 # Chame init_db() ao iniciar a aplicação para garantir que as tabelas existam
 # Isso é importante para ambientes serverless onde o estado não é persistente
 init_db()
 
+# --- Provedores de Pix ---
+def create_http_session():
+    """
+    Cria uma sessão HTTP com keep-alive, reaproveitando as conexões TCP/TLS com o provedor.
+    """
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=64, max_retries=Retry(total=2, backoff_factor=0.1)))
+    return session
+
+class PixProvider(ABC):
+    """
+    Base para as APIs de pagamento Pix.
+    Cada provedor mantém sua própria sessão HTTP e implementa a geração e a consulta do Pix,
+    recebendo as credenciais da API ativa como (public_key, secret_key, token).
+    """
+    label = None
+    # Tempo máximo, em segundos, de espera pela resposta do provedor
+    timeout = 15
+
+    def __init__(self):
+        self.session = create_http_session()
+
+    @abstractmethod
+    def create(self, amount, user_id, timestamp, keys):
+        """
+        Gera o Pix e retorna {"pix_code": ..., "transaction_id": ...}.
+        """
+
+    @abstractmethod
+    def verify(self, transaction_id, keys):
+        """
+        Consulta e retorna o status do Pix.
+        """
+
+class OasyfyProvider(PixProvider):
+    label = 'Oasyfy'
+
+    def create(self, amount, user_id, timestamp, keys):
+        public_key, secret_key, _ = keys
+        headers = {
+            'Content-Type': 'application/json',
+            'x-public-key': public_key,
+            'x-secret-key': secret_key
+        }
+        body = {
+            "identifier": f"checkout-{timestamp}-{user_id}",
+            "amount": amount,
+            "client": {
+                "name": "Cliente Checkout",
+                "email": f"checkout-{timestamp}@example.com",
+                "phone": "00000000000",
+                "document": "12345678900" 
+            },
+            "products": [{"id": "1", "name": "Produto", "quantity": 1, "price": amount }],
+            "callbackUrl": "https://seu_webhook_de_confirmacoes"
+        }
+        response = self.session.post('https://app.oasyfy.com/api/v1/gateway/pix/receive', headers=headers, json=body, timeout=self.timeout)
+        response.raise_for_status()
+        response_data = response.json()
+        return {
+            "pix_code": response_data.get('pix', {}).get('code'),
+            "transaction_id": response_data.get('id')
+        }
+
+    def verify(self, transaction_id, keys):
+        public_key, secret_key, _ = keys
+        headers = {
+            'x-public-key': public_key,
+            'x-secret-key': secret_key
+        }
+        # A documentação da Oasyfy para GET é diferente
+        response = self.session.get(f'https://app.oasyfy.com/api/v1/gateway/payments/{transaction_id}', headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get('status')
+
+class PushinpayProvider(PixProvider):
+    label = 'Pushinpay'
+    create_url = 'https://api.pushinpay.com.br/api/v1/pix/cashin'
+    phone = "16977777777"
+    item_title = "Compra de Produto"
+    pix_code_field = 'qr_code'
+
+    def create(self, amount, user_id, timestamp, keys):
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': keys[2]
+        }
+        body = {
+            "name": "Cliente Checkout",
+            "email": f"checkout-{timestamp}@example.com",
+            "cpf": "12345678901",
+            "phone": self.phone,
+            "paymentMethod": "PIX",
+            "amount": amount * 100,
+            "traceable": True,
+            "items": [
+                {
+                    "unitPrice": amount * 100,
+                    "title": self.item_title,
+                    "quantity": 1,
+                    "tangible": False
+                }
+            ],
+            "postbackUrl": "https://seu_webhook_de_confirmacoes"
+        }
+        response = self.session.post(self.create_url, headers=headers, json=body, timeout=self.timeout)
+        response.raise_for_status()
+        response_data = response.json()
+        return {
+            "pix_code": response_data.get(self.pix_code_field),
+            "transaction_id": response_data.get('id')
+        }
+
+    def verify(self, transaction_id, keys):
+        headers = {
+            'Authorization': keys[2]
+        }
+        # Documentação da Ghostpay/Pushinpay para GET /transaction.getPayment
+        response = self.session.get(f'https://example.com.br/api/v1/transaction.getPayment?id={transaction_id}', headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json().get('status')
+
+class GhostpayProvider(PushinpayProvider):
+    label = 'Ghostpay'
+    # Endpoint da Ghostpay para criar transações de compra
+    create_url = 'https://example.com.br/api/v1/transaction.purchase'
+    phone = "+5516999999999"
+    item_title = "Acesso a Curso Online"
+    pix_code_field = 'pixCode'
+
+# Registro dos provedores suportados, indexado pelo campo 'type' da API
+PROVIDERS = {
+    'oasyfy': OasyfyProvider(),
+    'pushinpay': PushinpayProvider(),
+    'ghostpay': GhostpayProvider(),
+}
+
+# Cache do status de Pix consultado nos provedores, indexado por (user_id, tipo da API, transaction_id).
+# Status pendentes expiram rápido; status finais (pago, cancelado...) ficam mais tempo,
+# absorvendo o restante do polling do frontend.
+_PIX_STATUS_CACHE = TTLCache(maxsize=100_000, ttl=3)
+_PIX_FINAL_STATUS_CACHE = TTLCache(maxsize=100_000, ttl=300)
+_PIX_STATUS_CACHE_LOCK = threading.Lock()
+PIX_FINAL_STATUSES = {'paid', 'approved', 'completed', 'cancelled', 'canceled', 'expired', 'refunded', 'failed'}
+# Valores de max-age (segundos) enviados no Cache-Control de /verificar-pix
+PIX_STATUS_MAX_AGE = 2
+PIX_FINAL_STATUS_MAX_AGE = 60
+# Sentinela para diferenciar "sem entrada no cache" de um status None em cache
+_MISSING = object()
+
+def is_final_pix_status(status):
+    """
+    Indica se o status do Pix não muda mais (pago, cancelado, expirado...).
+    """
+    return isinstance(status, str) and status.lower() in PIX_FINAL_STATUSES
+
+def get_cached_pix_status(cache_key):
+    """
+    Retorna (encontrado, status) a partir do cache de status de Pix.
+    """
+    with _PIX_STATUS_CACHE_LOCK:
+        for cache in (_PIX_FINAL_STATUS_CACHE, _PIX_STATUS_CACHE):
+            # Uma única leitura: entre um 'in' e um '[]' a entrada poderia expirar (KeyError)
+            status = cache.get(cache_key, _MISSING)
+            if status is not _MISSING:
+                return True, status
+    return False, None
+
+def cache_pix_status(cache_key, status):
+    """
+    Guarda o status consultado no provedor, por mais tempo quando ele é final.
+    """
+    cache = _PIX_FINAL_STATUS_CACHE if is_final_pix_status(status) else _PIX_STATUS_CACHE
+    with _PIX_STATUS_CACHE_LOCK:
+        cache[cache_key] = status
+
 # --- Funções de Autenticação e Utilitários ---
+def ojson(obj, status=200):
+    """
+    Monta uma resposta JSON serializada diretamente com o orjson.
+    """
+    return app.response_class(orjson.dumps(obj), status=status, mimetype='application/json')
+
+# Cache em memória de token -> user_id, evitando um SELECT a cada requisição autenticada
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=300)
+# Tokens desconhecidos ficam em cache por pouco tempo para amortecer tentativas de força bruta
+_INVALID_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=5)
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+def invalidate_token(token):
+    """
+    Remove um token dos caches de autenticação (ex.: após criação, rotação ou exclusão).
+    """
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE.pop(token, None)
+        _INVALID_TOKEN_CACHE.pop(token, None)
+
 def get_user_id_from_token(token):
     """
-    Busca o ID do usuário no banco de dados a partir do token de autenticação.
+    Busca o ID do usuário a partir do token de autenticação.
+    Consulta o cache antes de ir ao banco de dados.
     """
+    with _TOKEN_CACHE_LOCK:
+        user_id = _TOKEN_CACHE.get(token)
+        if user_id is not None:
+            return user_id
+        if token in _INVALID_TOKEN_CACHE:
+            return None
+
     conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM users WHERE auth_token = %s", (token,))
+    cursor = conn.cursor(binary=True)
+    cursor.execute(_SQL_USER_BY_TOKEN, (token,))
     user = cursor.fetchone()
     cursor.close()
-    return user['id'] if user else None
+
+    with _TOKEN_CACHE_LOCK:
+        if user:
+            _TOKEN_CACHE[token] = user[0]
+        else:
+            _INVALID_TOKEN_CACHE[token] = True
+    return user[0] if user else None
+
+def get_auth_token():
+    """
+    Extrai o token Bearer do cabeçalho Authorization, ou None se ausente/mal formado.
+    """
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return auth_header.split(' ')[1]
+
+# Cache em memória de user_id -> API ativa. A invalidação em set_active_api só vale para o
+# processo atual (e pode perder a corrida com uma consulta em andamento), então o TTL é curto:
+# após trocar de provedor, nenhum processo gera cobranças com a API antiga por mais de alguns segundos.
+_ACTIVE_API_CACHE = TTLCache(maxsize=10_000, ttl=5)
+_ACTIVE_API_CACHE_LOCK = threading.Lock()
+
+def invalidate_active_api(user_id):
+    """
+    Remove a API ativa do usuário do cache (ex.: após trocar a API ativa).
+    """
+    with _ACTIVE_API_CACHE_LOCK:
+        _ACTIVE_API_CACHE.pop(user_id, None)
+
+def fetch_active_api_for_token(token):
+    """
+    Busca, em uma única consulta, o usuário dono do token e sua API ativa.
+    Retorna (user_id, (name, type, public_key, secret_key, token)).
+    Se o usuário não tiver API ativa, retorna (user_id, None); se o token for inválido, (None, None).
+    Quando o token e a API ativa já estão em cache, o banco não é consultado.
+    """
+    with _TOKEN_CACHE_LOCK:
+        # Tokens sabidamente inválidos não chegam ao banco (amortece força bruta nas rotas de Pix)
+        if token in _INVALID_TOKEN_CACHE:
+            return None, None
+        user_id = _TOKEN_CACHE.get(token)
+    if user_id is not None:
+        with _ACTIVE_API_CACHE_LOCK:
+            active_api = _ACTIVE_API_CACHE.get(user_id)
+        if active_api is not None:
+            return user_id, active_api
+
+    conn = get_db()
+    cursor = conn.cursor(binary=True)
+    cursor.execute(_SQL_ACTIVE_API_BY_TOKEN, (token,))
+    row = cursor.fetchone()
+    cursor.close()
+
+    if row:
+        user_id, active_api = row[0], row[1:]
+        with _TOKEN_CACHE_LOCK:
+            _TOKEN_CACHE[token] = user_id
+        with _ACTIVE_API_CACHE_LOCK:
+            _ACTIVE_API_CACHE[user_id] = active_api
+        return user_id, active_api
+    # Sem linha: distingue token inválido de usuário sem API ativa (consulta em cache)
+    return get_user_id_from_token(token), None
 
 def require_auth(func):
     """
@@ -107,20 +499,46 @@ def require_auth(func):
     """
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        if not auth_header or not auth_header.startswith('Bearer '):
-            return jsonify({"message": "Token de autenticação ausente ou inválido."}), 401
+        auth_token = get_auth_token()
+        if not auth_token:
+            return ojson({"message": "Token de autenticação ausente ou inválido."}, 401)
         
-        auth_token = auth_header.split(' ')[1]
         user_id = get_user_id_from_token(auth_token)
         
         if not user_id:
-            return jsonify({"message": "Token de autenticação inválido."}), 401
+            return ojson({"message": "Token de autenticação inválido."}, 401)
         
         kwargs['user_id'] = user_id
         return func(*args, **kwargs)
     return wrapper
 
+def require_active_api(func):
+    """
+    Decorador para as rotas de Pix.
+    Valida o token e carrega a API ativa do usuário em uma única ida ao banco,
+    passando 'user_id' e 'active_api' para a rota.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        auth_token = get_auth_token()
+        if not auth_token:
+            return ojson({"message": "Token de autenticação ausente ou inválido."}, 401)
+
+        user_id, active_api = fetch_active_api_for_token(auth_token)
+        # As rotas de Pix não usam mais o banco: libera a conexão antes da chamada ao provedor
+        release_request_db()
+
+        if not user_id:
+            return ojson({"message": "Token de autenticação inválido."}, 401)
+
+        if not active_api:
+            return ojson({"message": "Nenhuma API de pagamento ativa. Ative uma no seu painel de controle."}, 400)
+
+        kwargs['user_id'] = user_id
+        kwargs['active_api'] = active_api
+        return func(*args, **kwargs)
+    return wrapper
+
 # --- Rotas de Usuário ---
 @app.route('/users/register', methods=['POST'])
 def register_user():
@@ -128,23 +546,24 @@ def register_user():
     Rota para registrar um novo usuário e gerar um token de autenticação.
     """
     conn = get_db()
-    cursor = conn.cursor()
+    cursor = conn.cursor(binary=True)
     username = request.json.get('username')
     
     if not username:
-        return jsonify({"message": "Username é obrigatório."}), 400
+        return ojson({"message": "Username é obrigatório."}, 400)
     
     try:
         auth_token = str(uuid.uuid4())
-        cursor.execute("INSERT INTO users (username, auth_token) VALUES (%s, %s)", (username, auth_token))
-        conn.commit()
-        return jsonify({"message": "Usuário registrado com sucesso!", "username": username, "auth_token": auth_token}), 201
-    except psycopg2.errors.UniqueViolation: # Erro específico para violação de UNIQUE no PostgreSQL
-        conn.rollback() # Desfaz a transação
-        return jsonify({"message": "Username já existe."}), 400
+        # ON CONFLICT evita a exceção e o rollback quando o username já existe
+        with conn.transaction():
+            cursor.execute(_SQL_REGISTER_USER, (username, auth_token))
+            created = cursor.fetchone() is not None
+        if not created:
+            return ojson({"message": "Username já existe."}, 400)
+        invalidate_token(auth_token)
+        return ojson({"message": "Usuário registrado com sucesso!", "username": username, "auth_token": auth_token}, 201)
     except Exception as e:
-        conn.rollback()
-        return jsonify({"message": f"Erro ao registrar usuário: {e}"}), 500
+        return ojson({"message": f"Erro ao registrar usuário: {e}"}, 500)
     finally:
         cursor.close()
 
@@ -156,37 +575,53 @@ def manage_apis(user_id):
     Rota para adicionar uma nova API ou listar as APIs de um usuário.
     """
     conn = get_db()
-    cursor = conn.cursor()
+    cursor = conn.cursor(binary=True)
 
     if request.method == 'POST':
         data = request.json
-        name = data.get('name')
-        api_type = data.get('type')
-        public_key = data.get('publicKey', '')
-        secret_key = data.get('secretKey', '')
-        token = data.get('token', '')
+        # Aceita uma única API ou uma lista de APIs, inseridas em um único INSERT
+        items = data if isinstance(data, list) else [data]
+        # Cada API precisa de um nome em texto (também evita valores não hasheáveis no filtro abaixo)
+        if not items or not all(isinstance(item, dict) and isinstance(item.get('name'), str) for item in items):
+            cursor.close()
+            return ojson({"message": "Envie uma API ou uma lista de APIs."}, 400)
+
+        names = [item.get('name') for item in items]
+        # Nomes repetidos no mesmo lote seriam descartados em silêncio pelo ON CONFLICT
+        if len(set(names)) != len(names):
+            cursor.close()
+            return ojson({"message": "A lista contém APIs com nomes repetidos."}, 400)
+        columns = (
+            names,
+            [item.get('type') for item in items],
+            [item.get('publicKey', '') for item in items],
+            [item.get('secretKey', '') for item in items],
+            [item.get('token', '') for item in items],
+        )
 
         try:
-            cursor.execute("""
-                INSERT INTO apis (user_id, name, type, public_key, secret_key, token)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (user_id, name, api_type, public_key, secret_key, token))
-            conn.commit()
-            return jsonify({"message": "API salva com sucesso!"}), 201
-        except psycopg2.errors.UniqueViolation:
-            conn.rollback()
-            return jsonify({"message": "Já existe uma API com este nome para este usuário."}), 400
+            with conn.transaction():
+                cursor.execute(_SQL_INSERT_APIS, (user_id, *columns))
+                inserted_names = {row[0] for row in cursor.fetchall()}
+
+            if not isinstance(data, list):
+                if not inserted_names:
+                    return ojson({"message": "Já existe uma API com este nome para este usuário."}, 400)
+                return ojson({"message": "API salva com sucesso!"}, 201)
+
+            skipped = [name for name in names if name not in inserted_names]
+            return ojson({"message": f"{len(inserted_names)} API(s) salva(s) com sucesso!", "skipped": skipped}, 201)
         except Exception as e:
-            conn.rollback()
-            return jsonify({"message": f"Erro ao salvar API: {e}"}), 500
+            return ojson({"message": f"Erro ao salvar API: {e}"}, 500)
         finally:
             cursor.close()
 
     if request.method == 'GET':
-        cursor.execute("SELECT id, name, is_active FROM apis WHERE user_id = %s", (user_id,))
-        apis = [{"id": row['id'], "name": row['name'], "isActive": row['is_active']} for row in cursor.fetchall()]
+        # O próprio PostgreSQL monta o JSON da lista; o texto é devolvido sem passar por dicionários Python
+        cursor.execute(_SQL_LIST_APIS_JSON, (user_id,))
+        apis_json = cursor.fetchone()[0]
         cursor.close()
-        return jsonify(apis)
+        return app.response_class(apis_json, mimetype='application/json')
 
 @app.route('/apis/set-active/<int:api_id>', methods=['POST'])
 @require_auth
@@ -195,198 +630,79 @@ def set_active_api(user_id, api_id):
     Rota para definir qual API de um usuário está ativa.
     """
     conn = get_db()
-    cursor = conn.cursor()
+    cursor = conn.cursor(binary=True)
 
     try:
-        # Desativa todas as APIs do usuário
-        cursor.execute("UPDATE apis SET is_active = FALSE WHERE user_id = %s", (user_id,))
-        
-        # Ativa a API selecionada para o usuário
-        cursor.execute("UPDATE apis SET is_active = TRUE WHERE id = %s AND user_id = %s", (api_id, user_id))
-        conn.commit()
-        
-        if cursor.rowcount == 0:
-            return jsonify({"message": "API não encontrada ou não pertence ao usuário."}), 404
+        # Ativa a API selecionada e desativa as demais do usuário em um único UPDATE.
+        with conn.transaction():
+            cursor.execute(_SQL_SET_ACTIVE_API, (api_id, user_id))
+            updated_ids = [row[0] for row in cursor.fetchall()]
+            if api_id not in updated_ids:
+                raise Rollback() # Mantém a API ativa atual se a selecionada não existir
+
+        if api_id not in updated_ids:
+            return ojson({"message": "API não encontrada ou não pertence ao usuário."}, 404)
 
-        return jsonify({"message": f"API com ID {api_id} ativada."}), 200
+        invalidate_active_api(user_id)
+        return ojson({"message": f"API com ID {api_id} ativada."}, 200)
     except Exception as e:
-        conn.rollback()
-        return jsonify({"message": f"Erro ao ativar API: {e}"}), 500
+        return ojson({"message": f"Erro ao ativar API: {e}"}, 500)
     finally:
         cursor.close()
 
 # --- Rotas para Geração e Consulta de Pix ---
 @app.route('/gerar-pix', methods=['POST'])
-@require_auth
-def gerar_pix(user_id):
+@require_active_api
+def gerar_pix(user_id, active_api):
     """
     Rota para gerar um Pix usando a API ativa do usuário.
     """
-    conn = get_db()
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT name, type, public_key, secret_key, token FROM apis WHERE user_id = %s AND is_active = TRUE", (user_id,))
-    active_api = cursor.fetchone()
-    cursor.close()
-
-    if not active_api:
-        return jsonify({"message": "Nenhuma API de pagamento ativa. Ative uma no seu painel de controle."}), 400
-
     name, api_type, public_key, secret_key, token = active_api
+    provider = PROVIDERS.get(api_type)
+    if provider is None:
+        return ojson({"message": f"API '{api_type}' não suportada."}, 400)
+
     data = request.json
     amount = data.get('amount')
+    # Carimbo de data/hora calculado uma única vez para identificador e e-mail
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
 
-    # Lógica para chamar a API de pagamento correta
-    if api_type == 'oasyfy':
-        headers = {
-            'Content-Type': 'application/json',
-            'x-public-key': public_key,
-            'x-secret-key': secret_key
-        }
-        body = {
-            "identifier": f"checkout-{datetime.now().strftime('%Y%m%d%H%M%S')}-{user_id}",
-            "amount": amount,
-            "client": {
-                "name": "Cliente Checkout",
-                "email": f"checkout-{datetime.now().strftime('%Y%m%d%H%M%S')}@example.com",
-                "phone": "00000000000",
-                "document": "12345678900" 
-            },
-            "products": [{"id": "1", "name": "Produto", "quantity": 1, "price": amount }],
-            "callbackUrl": "https://seu_webhook_de_confirmacoes"
-        }
-        try:
-            response = requests.post('https://app.oasyfy.com/api/v1/gateway/pix/receive', headers=headers, json=body)
-            response.raise_for_status() 
-            response_data = response.json()
-            return jsonify({
-                "pix_code": response_data.get('pix', {}).get('code'),
-                "transaction_id": response_data.get('id')
-            })
-        except requests.exceptions.RequestException as e:
-            return jsonify({"message": f"Erro na requisição Oasyfy: {str(e)}"}), 500
-
-    elif api_type == 'pushinpay':
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': token
-        }
-        body = {
-            "name": "Cliente Checkout",
-            "email": f"checkout-{datetime.now().strftime('%Y%m%d%H%M%S')}@example.com",
-            "cpf": "12345678901",
-            "phone": "16977777777",
-            "paymentMethod": "PIX",
-            "amount": amount * 100,
-            "traceable": True,
-            "items": [
-                {
-                    "unitPrice": amount * 100,
-                    "title": "Compra de Produto",
-                    "quantity": 1,
-                    "tangible": False
-                }
-            ],
-            "postbackUrl": "https://seu_webhook_de_confirmacoes"
-        }
-        try:
-            response = requests.post('https://api.pushinpay.com.br/api/v1/pix/cashin', headers=headers, json=body)
-            response.raise_for_status()
-            response_data = response.json()
-            return jsonify({
-                "pix_code": response_data.get('qr_code'),
-                "transaction_id": response_data.get('id')
-            })
-        except requests.exceptions.RequestException as e:
-            return jsonify({"message": f"Erro na requisição Pushinpay: {str(e)}"}), 500
-    
-    elif api_type == 'ghostpay':
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': token
-        }
-        body = {
-            "name": "Cliente Checkout",
-            "email": f"checkout-{datetime.now().strftime('%Y%m%d%H%M%S')}@example.com",
-            "cpf": "12345678901",
-            "phone": "+5516999999999",
-            "paymentMethod": "PIX",
-            "amount": amount * 100,
-            "traceable": True,
-            "items": [
-                {
-                    "unitPrice": amount * 100,
-                    "title": "Acesso a Curso Online",
-                    "quantity": 1,
-                    "tangible": False
-                }
-            ],
-            "postbackUrl": "https://seu_webhook_de_confirmacoes"
-        }
-        try:
-            # Endpoint da Ghostpay para criar transações de compra
-            response = requests.post('https://example.com.br/api/v1/transaction.purchase', headers=headers, json=body)
-            response.raise_for_status()
-            response_data = response.json()
-            return jsonify({
-                "pix_code": response_data.get('pixCode'),
-                "transaction_id": response_data.get('id')
-            })
-        except requests.exceptions.RequestException as e:
-            return jsonify({"message": f"Erro na requisição Ghostpay: {str(e)}"}), 500
-
-    return jsonify({"message": f"API '{api_type}' não suportada."}), 400
+    try:
+        return ojson(provider.create(amount, user_id, timestamp, (public_key, secret_key, token)))
+    except requests.exceptions.RequestException as e:
+        return ojson({"message": f"Erro na requisição {provider.label}: {str(e)}"}, 500)
 
 
 @app.route('/verificar-pix', methods=['GET'])
-@require_auth
-def verificar_pix(user_id):
+@require_active_api
+def verificar_pix(user_id, active_api):
     """
     Rota para verificar o status de um Pix usando a API ativa do usuário.
     """
-    conn = get_db()
-    cursor = conn.cursor()
     transaction_id = request.args.get('transaction_id')
 
     if not transaction_id:
-        return jsonify({"message": "ID da transação é obrigatório."}), 400
-
-    cursor.execute("SELECT name, type, public_key, secret_key, token FROM apis WHERE user_id = %s AND is_active = TRUE", (user_id,))
-    active_api = cursor.fetchone()
-    cursor.close()
+        return ojson({"message": "ID da transação é obrigatório."}, 400)
 
-    if not active_api:
-        return jsonify({"message": "Nenhuma API de pagamento ativa. Ative uma no seu painel de controle."}), 400
-    
     name, api_type, public_key, secret_key, token = active_api
+    provider = PROVIDERS.get(api_type)
+    if provider is None:
+        return ojson({"message": f"API '{api_type}' não suportada para consulta."}, 400)
 
-    # Lógica para chamar o endpoint de consulta correto para cada API
-    if api_type == 'oasyfy':
-        headers = {
-            'x-public-key': public_key,
-            'x-secret-key': secret_key
-        }
-        try:
-            # A documentação da Oasyfy para GET é diferente
-            response = requests.get(f'https://app.oasyfy.com/api/v1/gateway/payments/{transaction_id}', headers=headers)
-            response.raise_for_status()
-            return jsonify({"status": response.json().get('status')})
-        except requests.exceptions.RequestException as e:
-            return jsonify({"message": f"Erro na requisição Oasyfy: {str(e)}"}), 500
-    
-    elif api_type == 'pushinpay' or api_type == 'ghostpay':
-        headers = {
-            'Authorization': token
-        }
+    # Consultas repetidas (polling do frontend) são respondidas pelo cache, sem chamar o provedor
+    cache_key = (user_id, api_type, transaction_id)
+    found, status = get_cached_pix_status(cache_key)
+    if not found:
         try:
-            # Documentação da Ghostpay/Pushinpay para GET /transaction.getPayment
-            response = requests.get(f'https://example.com.br/api/v1/transaction.getPayment?id={transaction_id}', headers=headers)
-            response.raise_for_status()
-            return jsonify({"status": response.json().get('status')})
+            status = provider.verify(transaction_id, (public_key, secret_key, token))
         except requests.exceptions.RequestException as e:
-            return jsonify({"message": f"Erro na requisição {api_type}: {str(e)}"}), 500
+            return ojson({"message": f"Erro na requisição {provider.label}: {str(e)}"}, 500)
+        cache_pix_status(cache_key, status)
 
-    return jsonify({"message": f"API '{api_type}' não suportada para consulta."}), 400
+    response = ojson({"status": status})
+    max_age = PIX_FINAL_STATUS_MAX_AGE if is_final_pix_status(status) else PIX_STATUS_MAX_AGE
+    response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    return response
 
 # O Vercel executa a aplicação diretamente, então o init_db() deve ser chamado no escopo global.
 # Isso garante que as tabelas sejam criadas na primeira inicialização do contêiner.
@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+# Ponto de entrada WSGI para servidores de produção (gunicorn).
+# Uso: gunicorn -c gunicorn.conf.py wsgi:app
+from servidor import app